@@ -37,7 +37,7 @@ BENCH = -1
 # stat analysis)
 INTERACTIONS_MEAN = 872
 INTERACTIONS_STDEV = 40
-# this is set for the day by the setter function
+# this is set for the day from the generated arrivals
 INTERACTIONS_TODAY = 0
 # in seconds (480 sec = 8 min) 10.6min = 640 sec, effective handle time, 
 #   based on 45 interaction per agent. This was the average as of 2/8/23 with
@@ -52,6 +52,9 @@ HOUR_INTERVAL = 0
 
 # 60 seconds * 60 minutes = 1 hour
 SIM_TIME = 60 * 60
+# 24 hours = 1 day
+DAY_TIME = SIM_TIME * 24
+CURRENT_DAY = 0
 CURRENT_HOUR = 0
 WAIT_TIMES = []
 CUSTOMERS_HANDLED = 0
@@ -60,6 +63,9 @@ CURRENT_HOUR = 0
 CUSTOMERS_WAITING = []
 # the wait times for the customers that did not get processed last hour
 RESIDUAL_WAIT_TIMES = []
+# customers with an agent when a given execution of the sim ends, holds the
+#   cust name, their wait time and the handle time they have left
+CUSTOMERS_IN_SERVICE = []
 # dictionary for setting the proportion of customer interactions that come
 #   in for each hour
 WORK_PORTIONS = {
@@ -69,6 +75,12 @@ WORK_PORTIONS = {
     '18': .010, '19': .007, '20': .004, '21': .003, '22': .003, '23': .003
 }
 
+# dictionary for scaling the daily interaction volume for each day of the week
+#   (0 is Monday). Flat until there is per-day data to base it on.
+DAY_FACTORS = {
+    '0': 1.0, '1': 1.0, '2': 1.0, '3': 1.0, '4': 1.0, '5': 1.0, '6': 1.0
+}
+
 AGENT_PORTIONS = {
     '0': .04, '1': .04, '2': .04, '3': .09, '4': .18, '5': .4,
     '6': .57, '7': .62, '8': .74, '9': .79, '10': .84, '11': .88,
@@ -87,9 +99,13 @@ class CallCenter:
         self.staff = simpy.Resource(env, num_employees)
         self.support_time = handle_time
 
-    def support(self, customer):
+    def handle_time(self):
         # time it takes to handle a call
-        random_time = max(1, np.random.normal(self.support_time, 4)) # np.random.normal args (mean, standard dev)
+        return max(1, np.random.normal(self.support_time, 4)) # np.random.normal args (mean, standard dev)
+
+    def support(self, customer, random_time=None):
+        if random_time is None:
+            random_time = self.handle_time()
         yield self.env.timeout(random_time)
         print(f"Support finished for {customer} at {self.env.now:.2f}")
 
@@ -130,11 +146,11 @@ def set_agents_working(hour=12):
 
     # hours between 3 am and 9 pm inclusive
     else:
-        previous_agent_count = get_agents_working_count()
         decrement_agent_hours_left()
         ideal_agents_working = int(AGENT_STARTS * AGENT_PORTIONS[str(CURRENT_HOUR)])
         print("Ideal number of agents working:", ideal_agents_working)
-        ideal_agents_added = ideal_agents_working - previous_agent_count
+        # counting after the decrement, agents whose shift just ended are gone
+        ideal_agents_added = ideal_agents_working - get_agents_working_count()
 
         # case where staff and caseload are ramping up
         if ideal_agents_working > get_agents_working_count():
@@ -147,6 +163,11 @@ def set_agents_working(hour=12):
             elif ideal_agents_added > BENCH:
                 for i in range(BENCH):
                     add_agent()
+
+    # the night agent covers any hour that would otherwise have no one, 
+    #   with 0 hours left they come off again at the next hour
+    if get_agents_working_count() == 0:
+        add_agent(0, -1)
     
     print("On bench:", BENCH)
     # for agent in AGENTS_WORKING:
@@ -219,48 +240,81 @@ def day_customer_interval(hour=12):
     return CUSTOMER_INTERVAL
 
 
-def hour_customer_interval(hour=12):
+def fit_work_portions(path='interaction distribution.xlsx', column='smoothed'):
     """
-    Provides the interval upon which the work comes in for a given hour.
-    Assumes: 
-        INTERACTIONS_TODAY has been set.
-        CURRENT_HOUR has been set.
+    Builds a WORK_PORTIONS style dict from the hourly interaction counts in
+        the interaction distribution spreadsheet.
 
-    Returns: int representing the number of seconds between customer 
-        interactions coming in.
+    column: "interactions" for the raw counts, "smoothed" for the smoothed ones.
+
+    Returns: dict of str(hour) -> proportion of the day's interactions.
     """
-    # global HOUR_INTERVAL
-    # # portion of total interactions that are expected to come in this hour
-    # portion = WORK_PORTIONS[str(hour)]
-    # print("portion of work", portion)
-    # day_interactions = int(
-    #     np.random.normal(INTERACTIONS_MEAN, INTERACTIONS_STDEV, 1))
-    # print("day interactions:", day_interactions)
-    # hour_interactions = portion * day_interactions
-    # HOUR_INTERVAL = int(60 * 60 * 24 / hour_interactions)
+    df = pd.read_excel(path)
+    # first 24 rows are the hours, the last one is the total
+    counts = df[column].iloc[:24].to_numpy(dtype=float)
+    portions = counts / counts.sum()
+
+    return {str(hour): portion for hour, portion in enumerate(portions)}
 
-    global HOUR_INTERVAL
 
-    interactions_this_hour = int(INTERACTIONS_TODAY * WORK_PORTIONS[str(CURRENT_HOUR)])
-    print("Interactions for hour", CURRENT_HOUR, " are:", interactions_this_hour)
-    HOUR_INTERVAL = int(3600 / interactions_this_hour)
-    print("Customer interval for this hour is:", HOUR_INTERVAL, "seconds.")
-    return HOUR_INTERVAL
+def generate_arrivals(days=7, first_day=0, work_portions=None, day_factors=None):
+    """
+    Generates the arrival time of every customer interaction for the whole
+        run up front, instead of sampling them one event at a time.
 
+    Daily volume is drawn once per day from INTERACTIONS_MEAN/STDEV scaled
+        by the day of week factor, each interaction is then placed in an hour
+        using the intraday portions and spread uniformly within that hour.
 
-def set_interactions_today():
-    global INTERACTIONS_TODAY
+    first_day: day of the week the run starts on (0 is Monday).
 
-    INTERACTIONS_TODAY = int(
-        np.random.normal(INTERACTIONS_MEAN, INTERACTIONS_STDEV, 1))
+    Returns: sorted np array of arrival times in seconds from the start of
+        the run.
+    """
+    if work_portions is None:
+        work_portions = WORK_PORTIONS
+    if day_factors is None:
+        day_factors = DAY_FACTORS
+
+    factors = np.array(
+        [day_factors[str((first_day + day) % 7)] for day in range(days)])
+    day_counts = np.maximum(0, np.random.normal(
+        INTERACTIONS_MEAN * factors, INTERACTIONS_STDEV * factors)).astype(int)
+
+    hour_p = np.array([work_portions[str(hour)] for hour in range(24)])
+    hour_p = hour_p / hour_p.sum()
+
+    total = day_counts.sum()
+    days_of_arrivals = np.repeat(np.arange(days), day_counts)
+    hours_of_arrivals = np.random.choice(24, size=total, p=hour_p)
+    arrivals = (days_of_arrivals * DAY_TIME + hours_of_arrivals * SIM_TIME
+                + np.random.uniform(0, SIM_TIME, total))
+    arrivals.sort()
+
+    return arrivals
 
 
-def customer(env, name, call_center, wait_time=0):
+def hour_arrivals(arrivals, day, hour):
+    """
+    Slices the arrivals that come in during the given hour out of the sorted
+        arrivals array.
+
+    Returns: np array of arrival times in seconds from the start of the hour.
+    """
+    hour_start = day * DAY_TIME + hour * SIM_TIME
+    start, end = np.searchsorted(arrivals, [hour_start, hour_start + SIM_TIME])
+
+    return arrivals[start:end] - hour_start
+
+
+def customer(env, name, call_center, wait_time=0, service_left=None):
     """ 
     Represents a customer interaction
 
     wait_time: int representing the number of seconds the customer has been 
         waiting.
+    service_left: seconds of handle time left for a customer that was with 
+        an agent when last hour ended, None for a customer still waiting.
     """
     global CUSTOMERS_HANDLED, CUSTOMERS_WAITING
 
@@ -273,17 +327,26 @@ def customer(env, name, call_center, wait_time=0):
     # 2d array that holds the cust name, their wait time if they are still in 
     #    the waiting queue
 
-    CUSTOMERS_WAITING.append([name, SIM_TIME - wait_start])
+    if service_left is None:
+        waiting = [name, SIM_TIME - wait_start]
+        CUSTOMERS_WAITING.append(waiting)
 
     with call_center.staff.request() as request:
         yield request
 
+        # once they have an agent they only carry over the handle time left
+        if service_left is None:
+            CUSTOMERS_WAITING.remove(waiting)
+            service_left = call_center.handle_time()
+        in_service = [name, SIM_TIME - wait_start, env.now + service_left - SIM_TIME]
+        CUSTOMERS_IN_SERVICE.append(in_service)
+
         #dividing the env.now time by 60 so that minutes are shown
         print(f"Customer {name} enterscall at {env.now/60:.2f}")
-        yield env.process(call_center.support(name))   
+        yield env.process(call_center.support(name, service_left))
 
         wait_end = env.now
-        CUSTOMERS_WAITING.pop(0)
+        CUSTOMERS_IN_SERVICE.remove(in_service)
         print(f"Customer {name} left call at {env.now/60:.2f}")
 
         speed_to_respond = wait_end - wait_start
@@ -293,26 +356,43 @@ def customer(env, name, call_center, wait_time=0):
 
 
 
-def run_sim(env, num_employees, handle_time, customer_interval, waiting=2):
+def run_sim(env, num_employees, handle_time, customer_interval, waiting=2,
+            arrivals=None):
     """
     Runs the simulation, simulates one hour per execution. 
+
+    arrivals: sorted np array of arrival times (seconds into the hour) from 
+        generate_arrivals(). When left as None, customers come in every 
+        customer_interval seconds instead.
     """
-    global CUSTOMERS_WAITING
+    global CUSTOMERS_WAITING, CUSTOMERS_IN_SERVICE
     # showing the customers waiting
     print("Customers waiting:", len(CUSTOMERS_WAITING))
     
 
     call_center = CallCenter(env, num_employees, handle_time)
 
-    # the range is the number of customers that are already waiting
-    # for 5 waiting, you would do range(1,6)
-    if len(CUSTOMERS_WAITING) == 0:
-        for i in range (1, 2):
-            env.process(customer(env, num_employees, call_center))
-    else:
+    # customers left over from last hour pick up where they were, the ones
+    #   that had an agent go first so they finish the handle time they have 
+    #   left. They add themselves back to the lists, so those start out empty
+    carried_in_service = CUSTOMERS_IN_SERVICE
+    CUSTOMERS_IN_SERVICE = []
+    for name, wait_time, service_left in carried_in_service:
+        env.process(customer(env, name, call_center, wait_time, service_left))
 
-        for i in range (1, len(CUSTOMERS_WAITING)):
-            env.process(customer(env, num_employees, call_center, CUSTOMERS_WAITING[i-1][1]))
+    carried_over = CUSTOMERS_WAITING
+    CUSTOMERS_WAITING = []
+    for name, wait_time in carried_over:
+        env.process(customer(env, name, call_center, wait_time))
+
+    if len(carried_over) == 0 and arrivals is None:
+        env.process(customer(env, num_employees, call_center))
+
+    if arrivals is not None:
+        for i, arrival in enumerate(arrivals, start=1):
+            yield env.timeout(arrival - env.now)
+            env.process(customer(env, i, call_center))
+        return
 
     while True:
         yield env.timeout(random.randint(customer_interval - 1, customer_interval + 1))
@@ -326,18 +406,42 @@ def run_sim(env, num_employees, handle_time, customer_interval, waiting=2):
 
 
 
-def simulate_day():
-    """runs the sim for 24 hours, tracking the necessary variables"""
-    global CURRENT_HOUR
+def simulate_day(day=0, arrivals=None):
+    """
+    runs the sim for 24 hours, tracking the necessary variables
+
+    day: index of the day in the arrivals array.
+    arrivals: sorted np array from generate_arrivals(), a single day is 
+        generated when left as None.
+    """
+    global CURRENT_DAY, CURRENT_HOUR, INTERACTIONS_TODAY, HOUR_INTERVAL, BENCH
+    global WAIT_TIMES, CUSTOMERS_HANDLED
+
+    if arrivals is None:
+        arrivals = generate_arrivals(days=1, first_day=day % 7)
+        day = 0
+
+    CURRENT_DAY = day
+    # the bench is refilled and the stats start over at the start of each day,
+    #   customers still waiting at midnight carry over to the new day
+    BENCH = -1
+    WAIT_TIMES = []
+    CUSTOMERS_HANDLED = 0
+    day_start, day_end = np.searchsorted(
+        arrivals, [day * DAY_TIME, (day + 1) * DAY_TIME])
+    INTERACTIONS_TODAY = int(day_end - day_start)
+    print("Interactions for day", CURRENT_DAY, "are:", INTERACTIONS_TODAY)
 
     for i in range(0, 24):
         CURRENT_HOUR = i
-        set_interactions_today()
         set_agents_working()
         my_env = simpy.Environment()
-        interval = hour_customer_interval(CURRENT_HOUR)
+        this_hour = hour_arrivals(arrivals, day, CURRENT_HOUR)
+        print("Interactions for hour", CURRENT_HOUR, " are:", len(this_hour))
+        HOUR_INTERVAL = int(SIM_TIME / max(1, len(this_hour)))
         agent_count = get_agents_working_count()
-        my_env.process(run_sim(my_env, agent_count, HANDLE_TIME, interval))
+        my_env.process(run_sim(
+            my_env, agent_count, HANDLE_TIME, HOUR_INTERVAL, arrivals=this_hour))
         my_env.run(until=SIM_TIME)
 
         # logging and displaying data
@@ -350,6 +454,17 @@ def simulate_day():
         log_data(my_df)
 
 
+def simulate_week(days=7):
+    """
+    runs the sim for a whole week, the arrivals for every day are generated 
+        once before the first day starts
+    """
+    arrivals = generate_arrivals(days)
+
+    for day in range(days):
+        simulate_day(day, arrivals)
+
+
 def max_output_possible():
     """
     Computes the number of interactions that could have been handled during
@@ -371,9 +486,11 @@ def get_asr():
     """
     Computes Average Speed to Respond
     Must be called after the sim has completed.
-    Return: float
+    Return: float, 0 if no interactions have been handled yet
     """
-    
+    if len(WAIT_TIMES) == 0:
+        return 0
+
     return sum(WAIT_TIMES) / len(WAIT_TIMES) / 60
 
 
@@ -412,7 +529,7 @@ def log_data(df):
 def main():
     # running the sim
     print("Starting Call Center Simulation")
-    simulate_day()
+    simulate_week()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,499 @@
+"""
+Simulates several support centers that overflow work to each other, with
+each center running in its own process.
+
+Each site has its own CallCenter, staffing calendar and arrivals (generated
+the same way as the 24hr sim). When a customer has waited overflow_wait
+seconds at a site with an overflow_to partner, they leave the queue and are
+transferred there, arriving TRANSFER_TIME seconds later and keeping their
+original arrival time for the wait time stats.
+
+Synchronization is conservative. A customer can only be transferred
+overflow_wait seconds after they came in, and transferred customers are never
+transferred again. So each site knows the earliest time it could send a
+transfer: the oldest customer still waiting, or its next arrival, plus
+overflow_wait. Sites with no overflow_to never send anything. Each site gets
+its own horizon, the earliest of those times plus TRANSFER_TIME over only the
+sites that transfer to it, since nothing can reach it before then. A site
+that nobody transfers to runs straight through to the end, and a site only
+ever waits on the sites that send to it, never on the rest of the federation.
+Sites report back at least every WINDOW_TIME so the sites they send to can
+follow close behind instead of waiting for the whole run.
+Every site draws from its own seeded random state, so running the sites in
+parallel gives the same answer as the reference run (processes=False), which
+puts every site in one shared environment and hands transfers straight to
+the destination.
+
+Usage:
+    python federation.py [--reference]
+    python federation.py --benchmark
+"""
+
+import math
+import multiprocessing
+import multiprocessing.connection
+import sys
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+import simpy
+
+from model_loader import load_model
+
+""" Global vars
+All of the time related variables are in seconds, and outputs converted to
+minutes later when data is recorded/displayed.
+"""
+# 60 seconds * 60 minutes = 1 hour
+HOUR_TIME = 60 * 60
+DAY_TIME = HOUR_TIME * 24
+DAYS = 7
+# how long a transferred customer takes to show up at the partner site, the
+#   a site can always run at least this far past the sites that send to it,
+#   so it must be above 0
+TRANSFER_TIME = 60
+# longest a site runs before reporting back its transfers
+WINDOW_TIME = DAY_TIME
+# dictionaries for the agents working each hour at each site
+VSC_CALENDAR = {
+    '0': 1, '1': 1, '2': 1, '3': 2, '4': 3, '5': 6,
+    '6': 9, '7': 11, '8': 13, '9': 14, '10': 14, '11': 15,
+    '12': 14, '13': 12, '14': 9, '15': 6, '16': 5, '17': 4,
+    '18': 4, '19': 2, '20': 2, '21': 2, '22': 1, '23': 1
+}
+PARTNER_CALENDAR = {
+    '0': 1, '1': 1, '2': 1, '3': 1, '4': 2, '5': 3,
+    '6': 5, '7': 6, '8': 7, '9': 8, '10': 8, '11': 8,
+    '12': 8, '13': 7, '14': 6, '15': 4, '16': 3, '17': 3,
+    '18': 2, '19': 2, '20': 1, '21': 1, '22': 1, '23': 1
+}
+# site name -> settings for that site
+#   overrides: globals of the 24hr sim used to generate the site's arrivals
+#   overflow_to: site that customers are transferred to, None to never transfer
+#   overflow_wait: seconds a customer waits before being transferred
+SITES = {
+    'VSC': {
+        'calendar': VSC_CALENDAR,
+        'handle_time': 579,
+        'overrides': {'INTERACTIONS_MEAN': 872, 'INTERACTIONS_STDEV': 40},
+        'overflow_to': 'partner',
+        'overflow_wait': 15 * 60,
+        'seed': 1,
+    },
+    'partner': {
+        'calendar': PARTNER_CALENDAR,
+        'handle_time': 540,
+        'overrides': {'INTERACTIONS_MEAN': 450, 'INTERACTIONS_STDEV': 25},
+        'overflow_to': None,
+        'overflow_wait': 15 * 60,
+        'seed': 2,
+    },
+}
+
+
+def site_call_center(model):
+    """
+    Returns: SiteCallCenter class extending the CallCenter of a loaded copy
+        of the 24hr sim.
+    """
+
+    class SiteCallCenter(model.CallCenter):
+        """
+        Extends the 24hr sim's CallCenter for one site, which stays in a
+            single environment for the whole run instead of a new one every
+            hour. So staffing follows the site's calendar, and agents going
+            off shift finish the interaction they are on first.
+        """
+
+        def __init__(self, env, calendar, handle_time, rng):
+            self.calendar = calendar
+            self.max_agents = max(calendar.values())
+            super().__init__(env, self.max_agents, handle_time)
+            # agents that are off shift are held by requests that outrank
+            #   customers
+            self.staff = simpy.PriorityResource(env, self.max_agents)
+            self.rng = rng
+            env.process(self.staffing())
+
+        def handle_time(self):
+            # drawn from the site's own random state so the answer doesn't
+            #   depend on how the sites are run
+            return max(1, self.rng.normal(self.support_time, 4))
+
+        def support(self, customer, random_time=None):
+            # same as the 24hr sim's, without printing every call
+            if random_time is None:
+                random_time = self.handle_time()
+            yield self.env.timeout(random_time)
+
+        def staffing(self):
+            """
+            Takes agents on and off shift at the start of every hour.
+            """
+            off_shift = []
+            while True:
+                hour = int(self.env.now // HOUR_TIME) % 24
+                off = self.max_agents - self.calendar[str(hour)]
+
+                while len(off_shift) < off:
+                    off_shift.append(self.staff.request(priority=-1))
+                while len(off_shift) > off:
+                    request = off_shift.pop()
+                    if request.triggered:
+                        self.staff.release(request)
+                    else:
+                        request.cancel()
+
+                yield self.env.timeout(HOUR_TIME - self.env.now % HOUR_TIME)
+
+    return SiteCallCenter
+
+
+class Site:
+    """
+    Represents one site of the federation, in its own SimPy environment.
+
+    env: environment shared by all of the sites for the reference run, None
+        for the site's own environment.
+    """
+
+    def __init__(self, name, config, days=DAYS, env=None):
+        self.name = name
+        self.overflow_to = config['overflow_to']
+        self.overflow_wait = config['overflow_wait']
+        self.env = simpy.Environment() if env is None else env
+        self.rng = np.random.RandomState(config['seed'])
+
+        # seeding before loading, HANDLE_TIME is drawn when the sim is loaded
+        np.random.seed(config['seed'])
+        model = load_model()
+        for setting, value in config['overrides'].items():
+            setattr(model, setting, value)
+        self.arrivals = model.generate_arrivals(days)
+
+        self.call_center = site_call_center(model)(
+            self.env, config['calendar'], config['handle_time'], self.rng)
+
+        self.wait_times = []
+        self.handled = 0
+        self.overflowed_out = 0
+        self.overflowed_in = 0
+        self.outbox = []
+        # name -> Site for the reference run, transfers go straight to the
+        #   destination instead of the outbox
+        self.neighbours = None
+        # name -> arrival of customers waiting here that can still overflow
+        self.waiting = {}
+        self.env.process(self.arrive())
+
+    def arrive(self):
+        """
+        Brings in the site's own customers at their generated arrival times.
+        """
+        for i, arrival in enumerate(self.arrivals, start=1):
+            yield self.env.timeout(arrival - self.env.now)
+            self.env.process(self.customer(f"{self.name}-{i}", arrival))
+
+    def transferred(self, arrive_at, name, arrival):
+        """
+        Brings in a customer transferred from another site.
+        """
+        yield self.env.timeout(max(0, arrive_at - self.env.now))
+        self.overflowed_in += 1
+        yield self.env.process(self.customer(name, arrival, can_overflow=False))
+
+    def customer(self, name, arrival, can_overflow=True):
+        """
+        Represents a customer interaction
+
+        arrival: time the customer first came in, at whichever site.
+        can_overflow: False for customers that were already transferred once.
+        """
+        with self.call_center.staff.request(priority=0) as request:
+            if can_overflow and self.overflow_to is not None:
+                patience = max(0, self.overflow_wait - (self.env.now - arrival))
+                self.waiting[name] = arrival
+                result = yield request | self.env.timeout(patience)
+                del self.waiting[name]
+                if request not in result:
+                    arrive_at = self.env.now + TRANSFER_TIME
+                    if self.neighbours is None:
+                        self.outbox.append((
+                            arrive_at, self.overflow_to, self.name, name, arrival))
+                    else:
+                        destination = self.neighbours[self.overflow_to]
+                        self.env.process(
+                            destination.transferred(arrive_at, name, arrival))
+                    self.overflowed_out += 1
+                    return
+            else:
+                yield request
+
+            self.wait_times.append(self.env.now - arrival)
+            yield self.env.process(self.call_center.support(name))
+            self.handled += 1
+
+    def next_send(self):
+        """
+        Returns: earliest time this site could transfer a customer, inf if it
+            never transfers.
+        """
+        if self.overflow_to is None:
+            return math.inf
+
+        oldest = min(self.waiting.values(), default=math.inf)
+        # arrivals at exactly now have not come in yet
+        i = np.searchsorted(self.arrivals, self.env.now)
+        next_arrival = self.arrivals[i] if i < len(self.arrivals) else math.inf
+
+        return min(oldest, next_arrival) + self.overflow_wait
+
+    def advance(self, until, incoming):
+        """
+        Runs the site up to until, after bringing in the transfers sent to it.
+
+        incoming: list of transfers from the other sites, all arriving at or
+            after the current time.
+
+        Returns: list of transfers this site sent while advancing, and the
+            earliest time it could send the next one.
+        """
+        # sorting so the order they were collected in does not matter
+        for arrive_at, _, source, name, arrival in sorted(incoming):
+            self.env.process(self.transferred(arrive_at, name, arrival))
+
+        self.env.run(until=until)
+        outgoing, self.outbox = self.outbox, []
+        return outgoing, self.next_send()
+
+    def results(self):
+        """
+        Returns: dict of the site's stats, times in minutes.
+        """
+        return {
+            "Site": self.name,
+            "Interactions": len(self.arrivals),
+            "Interactions Handled": self.handled,
+            "ASR": round(np.mean(self.wait_times) / 60, 2) if self.wait_times else 0,
+            "Overflowed Out": self.overflowed_out,
+            "Overflowed In": self.overflowed_in,
+        }
+
+
+def site_worker(conn, name, config, days):
+    """
+    Runs one site in its own process, taking commands from the parent.
+        Replies are ('ok', value), or ('error', traceback) if the site raised
+        so the parent can raise it too instead of waiting forever.
+    """
+    try:
+        site = Site(name, config, days)
+        while True:
+            command, args = conn.recv()
+            if command == 'advance':
+                conn.send(('ok', site.advance(*args)))
+            elif command == 'next_send':
+                conn.send(('ok', site.next_send()))
+            elif command == 'results':
+                conn.send(('ok', site.results()))
+                break
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
+def run_reference(sites=None, days=DAYS):
+    """
+    Runs all of the sites in one shared SimPy environment, with transfers
+        handed straight to the destination site. There is no synchronization
+        to get wrong, so this is what the parallel run is checked against.
+
+    Returns: dataframe with one row of stats per site.
+    """
+    if sites is None:
+        sites = SITES
+
+    env = simpy.Environment()
+    local_sites = {
+        name: Site(name, config, days, env) for name, config in sites.items()}
+    for site in local_sites.values():
+        site.neighbours = local_sites
+
+    env.run(until=days * DAY_TIME)
+    return pd.DataFrame([site.results() for site in local_sites.values()])
+
+
+def run_federation(sites=None, days=DAYS, processes=True):
+    """
+    Runs all of the sites together, each up to its own horizon at a time.
+
+    processes: run each site in its own process, False runs the single
+        environment reference run instead.
+
+    Returns: dataframe with one row of stats per site.
+    """
+    if sites is None:
+        sites = SITES
+    if not processes:
+        return run_reference(sites, days)
+    if TRANSFER_TIME <= 0:
+        raise ValueError("TRANSFER_TIME must be above 0 to synchronize sites")
+
+    conns = {}
+    workers = {}
+    for name, config in sites.items():
+        conn, child_conn = multiprocessing.Pipe()
+        worker = multiprocessing.Process(
+            target=site_worker, args=(child_conn, name, config, days))
+        worker.start()
+        conns[name] = conn
+        workers[name] = worker
+
+    def call(command, args, name):
+        conns[name].send((command, args))
+
+    def collect(name):
+        # checking on the worker while waiting, in case it died outright
+        while not conns[name].poll(1):
+            if not workers[name].is_alive():
+                raise RuntimeError(f"Site {name} stopped without replying")
+        status, value = conns[name].recv()
+        if status == 'error':
+            raise RuntimeError(f"Site {name} failed:\n{value}")
+        return value
+
+    def replied(names):
+        while True:
+            ready = multiprocessing.connection.wait(
+                [conns[name] for name in names], 1)
+            if ready:
+                return [name for name in names if conns[name] in ready]
+            for name in names:
+                if not workers[name].is_alive():
+                    raise RuntimeError(f"Site {name} stopped without replying")
+
+    try:
+        results = synchronize(sites, days, call, collect, replied)
+    finally:
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+
+    return results
+
+
+def synchronize(sites, days, call, collect, replied):
+    """
+    Steps each site through the run up to its own horizon, handing the
+        transfers to their destination sites as they come back. A site is
+        sent its next step as soon as it is free and its horizon has moved,
+        without waiting for the sites it does not receive from.
+
+    call: function(command, args, name) that sends a command to a site.
+    collect: function(name) that waits for the site's reply.
+    replied: function(names) that waits until any of the sites has replied,
+        and returns the ones that have.
+
+    Returns: dataframe with one row of stats per site.
+    """
+    end = days * DAY_TIME
+    # name -> sites that transfer customers to it
+    senders = {
+        name: [source for source, config in sites.items()
+               if config['overflow_to'] == name]
+        for name in sites}
+
+    for name in sites:
+        call('next_send', (), name)
+    next_sends = {name: collect(name) for name in sites}
+
+    def horizon(name):
+        # a running sender's last next_send still holds for anything it has
+        #   not reported yet, so nothing can reach the site before this
+        return min([end] + [
+            next_sends[source] + TRANSFER_TIME for source in senders[name]])
+
+    now = {name: 0 for name in sites}
+    inbox = {name: [] for name in sites}
+    running = set()
+    steps = 0
+    while True:
+        for name in sites:
+            until = min(horizon(name), now[name] + WINDOW_TIME)
+            if name in running or until <= now[name]:
+                continue
+            call('advance', (until, inbox[name]), name)
+            inbox[name] = []
+            now[name] = until
+            running.add(name)
+            steps += 1
+
+        # the site furthest behind can always move, so this only empties
+        #   once every site has reached the end
+        if not running:
+            break
+        for name in replied(running):
+            running.remove(name)
+            outgoing, next_sends[name] = collect(name)
+            for transfer in outgoing:
+                inbox[transfer[1]].append(transfer)
+    print("Advanced the sites", steps, "times")
+
+    for name in sites:
+        call('results', (), name)
+    return pd.DataFrame([collect(name) for name in sites])
+
+
+def benchmark(pair_counts=(1, 2, 4), days=DAYS):
+    """
+    Times the reference run against the parallel run for weakly coupled
+        sites, each VSC overflowing only to its own partner.
+
+    Returns: dataframe with the timings for each number of site pairs.
+    """
+    rows = []
+    for pairs in pair_counts:
+        sites = {}
+        for pair in range(pairs):
+            sites[f"VSC {pair}"] = dict(
+                SITES['VSC'], overflow_to=f"partner {pair}", seed=2 * pair + 1)
+            sites[f"partner {pair}"] = dict(SITES['partner'], seed=2 * pair + 2)
+
+        start = time.perf_counter()
+        reference = run_federation(sites, days, processes=False)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parallel = run_federation(sites, days, processes=True)
+        parallel_time = time.perf_counter() - start
+
+        rows.append({
+            "Sites": len(sites),
+            "Cores": multiprocessing.cpu_count(),
+            "Reference Secs": round(reference_time, 2),
+            "Parallel Secs": round(parallel_time, 2),
+            "Speedup": round(reference_time / parallel_time, 2),
+            "Same Answer": reference.equals(parallel),
+        })
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    if '--benchmark' in sys.argv:
+        print("Starting Federation Benchmark")
+        print(benchmark().to_string(index=False))
+        return
+
+    print("Starting Federation Simulation")
+    processes = '--reference' not in sys.argv
+    results = run_federation(processes=processes)
+    print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+Loads the 24hr simulation (24hr.py) as a module, which can't be imported by
+name since it starts with a digit.
+"""
+
+import importlib.util
+import os
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '24hr.py')
+
+
+def load_model(path=None):
+    """
+    Loads a fresh copy of the 24hr sim, so its globals start over every time.
+        Loading draws HANDLE_TIME from np.random, seed it first if the run
+        needs to be repeatable.
+    """
+    if path is None:
+        path = MODEL_PATH
+
+    spec = importlib.util.spec_from_file_location('vsc_24hr', path)
+    model = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(model)
+    return model
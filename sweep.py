@@ -0,0 +1,394 @@
+"""
+Runs replications of the 24hr simulation over a set of scenarios, split into
+work units that any number of worker processes, on any number of machines,
+can pull from a queue directory on a shared filesystem.
+
+Queue layout (under QUEUE_DIR):
+    pending/    work units waiting for a worker
+    claimed/    work units a worker is running, named after the unit and the
+                    worker's host and pid, the file's modified time is the
+                    worker's heartbeat
+    done/       finished work units
+    failed/     work units that raised an error, with a .txt of the traceback,
+                    move them back to pending/ to retry them
+    results/    one csv of results per finished work unit
+
+A worker claims a unit by renaming it from pending/ to claimed/, only one
+    rename can win. The claim is named after the worker, so a worker whose
+    lease ran out can only ever finish its own claim, never a new owner's. If a worker stops heartbeating for LEASE_TIME the unit is
+    renamed back to pending/ for another worker to pick up. Units are
+    idempotent (same scenario and seeds give the same rows), so a unit that
+    ends up being run twice just overwrites its own results file.
+
+Usage:
+    python sweep.py submit [queue_dir]
+    python sweep.py work [queue_dir]
+    python sweep.py merge [queue_dir]
+"""
+
+import contextlib
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+import model_loader
+
+""" Global vars
+All of the time related variables are in seconds.
+"""
+MODEL_PATH = model_loader.MODEL_PATH
+QUEUE_DIR = 'sweep_queue'
+RESULTS_FILE = 'sweep_results.csv'
+# scenario name -> globals of the 24hr sim to override for that scenario
+SCENARIOS = {
+    'baseline': {},
+    'agent_starts_12': {'AGENT_STARTS': 12},
+    'agent_starts_14': {'AGENT_STARTS': 14},
+}
+# replications run per scenario, and how many of them go in one work unit
+SEEDS = 20
+SEEDS_PER_UNIT = 5
+# days simulated per replication
+DAYS = 7
+# how often a worker touches its claimed unit, and how long a unit can go
+#   without being touched before it is put back in the queue
+HEARTBEAT_TIME = 30
+LEASE_TIME = 300
+# how long an idle worker waits before checking the queue again
+POLL_TIME = 10
+
+QUEUE_STATES = ('pending', 'claimed', 'done', 'failed', 'results')
+
+
+def queue_path(queue_dir, state, name=''):
+    """
+    Returns: path to a file (or the folder when name is blank) in the queue.
+    """
+    return os.path.join(queue_dir, state, name)
+
+
+def worker_id():
+    """
+    Returns: str identifying this worker process on any machine.
+    """
+    return f"{socket.gethostname()}.{os.getpid()}"
+
+
+def claim_unit_name(claim):
+    """
+    Returns: file name of the unit a claim in claimed/ is for.
+    """
+    return claim[:claim.index('.json') + len('.json')]
+
+
+def make_queue(queue_dir=QUEUE_DIR):
+    """
+    Creates the queue folders if they do not exist yet.
+    """
+    for state in QUEUE_STATES:
+        os.makedirs(queue_path(queue_dir, state), exist_ok=True)
+
+
+def write_atomic(path, write):
+    """
+    Writes a file next to path and renames it into place, so readers on
+        other machines never see a half written file.
+
+    write: function that takes the temporary path and writes to it.
+    """
+    tmp_path = f"{path}.{worker_id()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def make_units(scenarios=None, seeds=SEEDS, seeds_per_unit=SEEDS_PER_UNIT,
+               days=DAYS):
+    """
+    Splits the sweep into work units of one scenario and a range of seeds.
+
+    Returns: list of dicts describing each unit.
+    """
+    if scenarios is None:
+        scenarios = SCENARIOS
+
+    units = []
+    for scenario, overrides in scenarios.items():
+        for first_seed in range(0, seeds, seeds_per_unit):
+            last_seed = min(seeds, first_seed + seeds_per_unit)
+            units.append({
+                'unit_id': f"{scenario}_{first_seed:05d}-{last_seed - 1:05d}",
+                'scenario': scenario,
+                'overrides': overrides,
+                'seeds': [first_seed, last_seed],
+                'days': days,
+            })
+
+    return units
+
+
+def submit(units, queue_dir=QUEUE_DIR):
+    """
+    Puts work units in the pending queue. Units that are already in the
+        queue (in any state) are left alone, so submitting twice is safe.
+
+    Returns: int number of units added.
+    """
+    make_queue(queue_dir)
+    claimed = {
+        claim_unit_name(claim)
+        for claim in os.listdir(queue_path(queue_dir, 'claimed'))}
+
+    added = 0
+    for unit in units:
+        name = unit['unit_id'] + '.json'
+        if name in claimed or any(
+                os.path.exists(queue_path(queue_dir, state, name))
+                for state in ('pending', 'done', 'failed')):
+            continue
+
+        def write(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(unit, f)
+
+        write_atomic(queue_path(queue_dir, 'pending', name), write)
+        added += 1
+
+    print("Submitted", added, "work units to", queue_dir)
+    return added
+
+
+def claim_unit(queue_dir=QUEUE_DIR):
+    """
+    Claims the next pending unit by renaming it into claimed/, under a name
+        unique to this worker.
+
+    Returns: file name of the claim, None if nothing is pending.
+    """
+    for name in sorted(os.listdir(queue_path(queue_dir, 'pending'))):
+        if not name.endswith('.json'):
+            continue
+        pending = queue_path(queue_dir, 'pending', name)
+        try:
+            # starting the lease before the rename, rename keeps the modified
+            #   time and an old one would look expired as soon as it's claimed
+            os.utime(pending)
+            claim = f"{name}.{worker_id()}"
+            os.rename(pending, queue_path(queue_dir, 'claimed', claim))
+        except FileNotFoundError:
+            # another worker got to it first
+            continue
+        return claim
+
+    return None
+
+
+def requeue_expired(queue_dir=QUEUE_DIR, lease_time=None):
+    """
+    Puts claimed units whose worker stopped heartbeating back in pending/.
+
+    Returns: int number of units put back.
+    """
+    if lease_time is None:
+        lease_time = LEASE_TIME
+
+    requeued = 0
+    now = time.time()
+    for claim in os.listdir(queue_path(queue_dir, 'claimed')):
+        if '.json' not in claim:
+            continue
+        name = claim_unit_name(claim)
+        claimed = queue_path(queue_dir, 'claimed', claim)
+        try:
+            if now - os.path.getmtime(claimed) < lease_time:
+                continue
+            os.rename(claimed, queue_path(queue_dir, 'pending', name))
+        except FileNotFoundError:
+            # finished or requeued by someone else in the meantime
+            continue
+        print("Lease expired, requeued", claim)
+        requeued += 1
+
+    return requeued
+
+
+def heartbeat(path, stop, interval=None):
+    """
+    Touches the claimed unit every interval seconds until stop is set or the
+        unit is no longer claimed.
+    """
+    if interval is None:
+        interval = HEARTBEAT_TIME
+
+    while not stop.wait(interval):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+
+def run_replication(scenario, overrides, seed, days=DAYS):
+    """
+    Runs the 24hr sim for one seed of a scenario.
+
+    Returns: dataframe with one row per simulated hour.
+    """
+    # seeding before loading, HANDLE_TIME is drawn when the sim is loaded
+    random.seed(seed)
+    np.random.seed(seed)
+    rows = []
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        model = model_loader.load_model(MODEL_PATH)
+        for name, value in overrides.items():
+            setattr(model, name, value)
+
+        def log_data(df):
+            # the wall clock timestamp would make reruns of a unit differ
+            df = df.drop(columns="Timestamp")
+            df.insert(0, "Day", model.CURRENT_DAY)
+            rows.append(df)
+
+        # collecting the rows instead of appending them to log.csv
+        model.log_data = log_data
+        model.simulate_week(days)
+
+    results = pd.concat(rows, ignore_index=True)
+    results.insert(0, "Seed", seed)
+    results.insert(0, "Scenario", scenario)
+    return results
+
+
+def run_unit(unit, queue_dir=QUEUE_DIR):
+    """
+    Runs every seed in a work unit and saves the results for the unit.
+    """
+    first_seed, last_seed = unit['seeds']
+    results = pd.concat([
+        run_replication(unit['scenario'], unit['overrides'], seed, unit['days'])
+        for seed in range(first_seed, last_seed)
+    ], ignore_index=True)
+
+    write_atomic(
+        queue_path(queue_dir, 'results', unit['unit_id'] + '.csv'),
+        lambda tmp_path: results.to_csv(tmp_path, index=False))
+
+
+def work(queue_dir=QUEUE_DIR, wait=False):
+    """
+    Pulls work units from the queue and runs them until the queue is empty.
+
+    wait: keep polling for new units instead of stopping once nothing is
+        pending or claimed.
+
+    Returns: int number of units this worker finished.
+    """
+    make_queue(queue_dir)
+    worker = worker_id()
+    finished = 0
+
+    while True:
+        requeue_expired(queue_dir)
+        claim = claim_unit(queue_dir)
+
+        if claim is None:
+            if not wait and not os.listdir(queue_path(queue_dir, 'claimed')):
+                break
+            # units claimed by other workers may still come back
+            time.sleep(POLL_TIME)
+            continue
+
+        name = claim_unit_name(claim)
+        claimed = queue_path(queue_dir, 'claimed', claim)
+        try:
+            with open(claimed) as f:
+                unit = json.load(f)
+        except FileNotFoundError:
+            # lease was lost before the unit got started
+            continue
+        print(f"Worker {worker} running {unit['unit_id']}")
+
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat, args=(claimed, stop), daemon=True)
+        beat.start()
+        try:
+            run_unit(unit, queue_dir)
+            state = 'done'
+        except Exception:
+            # failing the unit instead of the worker, otherwise it would be
+            #   requeued and take down every worker that picks it up
+            error = traceback.format_exc()
+            print(f"Worker {worker} failed {unit['unit_id']}:\n{error}")
+
+            def write(tmp_path):
+                with open(tmp_path, 'w') as f:
+                    f.write(error)
+
+            write_atomic(
+                queue_path(queue_dir, 'failed', unit['unit_id'] + '.txt'), write)
+            state = 'failed'
+        finally:
+            stop.set()
+            beat.join()
+
+        try:
+            # only this worker's own claim, a rerun claims under another name
+            os.rename(claimed, queue_path(queue_dir, state, name))
+        except FileNotFoundError:
+            # lease expired while running, the results are saved already and
+            #   whoever reruns the unit will write the same ones
+            print(f"Worker {worker} lost the lease on {unit['unit_id']}")
+            continue
+        if state == 'done':
+            finished += 1
+
+    print(f"Worker {worker} finished {finished} work units")
+    return finished
+
+
+def merge_results(queue_dir=QUEUE_DIR, out=RESULTS_FILE):
+    """
+    Combines the results of every finished work unit into one csv. Can be
+        run while the sweep is still going to look at partial results.
+
+    Returns: dataframe of the merged results.
+    """
+    results_dir = queue_path(queue_dir, 'results')
+    frames = [
+        pd.read_csv(os.path.join(results_dir, name))
+        for name in sorted(os.listdir(results_dir)) if name.endswith('.csv')
+    ]
+    if not frames:
+        print("No results in", results_dir, "yet")
+        return pd.DataFrame()
+
+    results = pd.concat(frames, ignore_index=True)
+    results.to_csv(out, index=False)
+    print("Merged", len(frames), "work units into", out)
+    return results
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'work'
+    queue_dir = sys.argv[2] if len(sys.argv) > 2 else QUEUE_DIR
+
+    if command == 'submit':
+        submit(make_units(), queue_dir)
+    elif command == 'work':
+        work(queue_dir)
+    elif command == 'merge':
+        merge_results(queue_dir)
+    else:
+        print("Unknown command:", command)
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()